@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Room, Message, ReadReceipt
+from .models import OutboxTask, Room, Message, ReadReceipt
 
 
 class RoomAdmin(admin.ModelAdmin):
@@ -15,6 +15,11 @@ class ReadReceiptAdmin(admin.ModelAdmin):
     list_display = ("__str__", "last_read_message", "room")
 
 
+class OutboxTaskAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "status", "attempts", "available_at")
+
+
 admin.site.register(Room, RoomAdmin)
 admin.site.register(Message, MessageAdmin)
 admin.site.register(ReadReceipt, ReadReceiptAdmin)
+admin.site.register(OutboxTask, OutboxTaskAdmin)
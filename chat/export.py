@@ -0,0 +1,80 @@
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from chat.models import Message, Room
+from chat.sharding import get_shards
+
+# same keys as MessageSerializer, plus the room
+MESSAGE_KEYS = ("id", "room", "author", "content", "created_at")
+MESSAGE_FIELDS = ("id", "room_id", "author_id", "content", "created_at")
+
+
+def to_line(record: dict) -> bytes:
+    return (json.dumps(record, cls=DjangoJSONEncoder) + "\n").encode()
+
+
+def export_user(user, chunk_size: int = 1000):
+    """
+    yields the rooms of the user and their messages as NDJSON lines
+    querysets are read with .iterator(), postgres uses a server side
+    cursor for it, so only chunk_size rows are in memory at any time
+    """
+    yield to_line(
+        {"type": "user", "id": user.id, "username": user.username, "email": user.email}
+    )
+
+    # shards are read one after the other to keep the memory flat
+    for shard in get_shards():
+        yield from export_shard(user, shard, chunk_size)
+
+
+def export_shard(user, shard: str, chunk_size: int):
+    rooms = (
+        Room.objects.using(shard)
+        .filter(users=user.id)
+        .order_by("id")
+        .values("id", "title", "created_at")
+    )
+    for room in rooms.iterator(chunk_size=chunk_size):
+        users = list(
+            Room.users.through.objects.using(shard)
+            .filter(room_id=room["id"])
+            .values_list("user_id", flat=True)
+        )
+        yield to_line({"type": "room", **room, "users": users})
+
+        messages = (
+            Message.objects.using(shard)
+            .filter(room_id=room["id"])
+            .order_by("id")
+            .values_list(*MESSAGE_FIELDS)
+        )
+        for message in messages.iterator(chunk_size=chunk_size):
+            yield to_line({"type": "message", **dict(zip(MESSAGE_KEYS, message))})
+
+
+def gzip_stream(lines):
+    # wbits 16 + MAX_WBITS writes the gzip header and trailer
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for line in lines:
+        chunk = compressor.compress(line)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def buffered(lines, size: int = 64 * 1024):
+    # a write per line is too chatty for the socket, send bigger blocks
+    buffer = []
+    buffered_size = 0
+    for line in lines:
+        buffer.append(line)
+        buffered_size += len(line)
+        if buffered_size >= size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered_size = 0
+    if buffer:
+        yield b"".join(buffer)
@@ -0,0 +1,78 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.test import APIClient
+
+from chat.models import ReadReceipt, Room
+from chat.sharding import get_shards
+from chat.tasks import run_pending
+
+
+class Command(BaseCommand):
+    help = "Benchmark new_message/ latency with side effects run eagerly and queued"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        # runs on throwaway test databases, the real ones are not touched
+        setup_test_environment()
+        old_names = {}
+        try:
+            for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *get_shards()]):
+                old_names[alias] = connections[alias].creation.create_test_db(
+                    verbosity=0
+                )
+
+            user = User.objects.create(username="bench", email="bench@gchat.com")
+            room = Room.objects.create(created_by=user)
+            room.users.add(user)
+            ReadReceipt.objects.create(room=room, user=user, last_read_message=-1)
+
+            client = APIClient()
+            client.force_authenticate(user)
+
+            # throttling would only measure the 429s
+            rest_framework = {
+                **settings.REST_FRAMEWORK,
+                "DEFAULT_THROTTLE_RATES": {},
+            }
+            with override_settings(REST_FRAMEWORK=rest_framework):
+                for mode in ("eager", "outbox"):
+                    with override_settings(TASKS_MODE=mode):
+                        timings = self.measure(client, room, options["requests"])
+                    self.report(mode, timings)
+                    run_pending(options["requests"])
+        finally:
+            for alias, old_name in old_names.items():
+                connections[alias].creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def measure(self, client, room, count):
+        timings = []
+        for i in range(count):
+            start = time.perf_counter()
+            response = client.post(
+                "/api/chat/new_message/",
+                {"content": f"message {i}", "room": room.id},
+                format="json",
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 201, response.content
+        return sorted(timings)
+
+    def report(self, mode, timings):
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f"{mode:>8}: mean {statistics.mean(timings):.2f}ms  "
+            f"p50 {statistics.median(timings):.2f}ms  p95 {p95:.2f}ms"
+        )
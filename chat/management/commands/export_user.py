@@ -0,0 +1,36 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import buffered, export_user, gzip_stream
+
+
+class Command(BaseCommand):
+    help = "Export the rooms and message history of a user as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("email", help="email of the user to export")
+        parser.add_argument(
+            "--output", "-o", help="file to write to, stdout when not given"
+        )
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options["email"])
+        except User.DoesNotExist:
+            raise CommandError("User not found")
+
+        lines = export_user(user, chunk_size=options["chunk_size"])
+        chunks = gzip_stream(lines) if options["gzip"] else buffered(lines)
+
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
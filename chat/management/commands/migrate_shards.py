@@ -0,0 +1,32 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from chat.sharding import get_shards
+
+
+class Command(BaseCommand):
+    help = "Migrate the default database and every chat shard (CHAT_SHARDS)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="do not prompt the user for input",
+        )
+
+    def handle(self, *args, **options):
+        # default first, it holds the users and the room directory
+        databases = [DEFAULT_DB_ALIAS]
+        databases += [shard for shard in get_shards() if shard != DEFAULT_DB_ALIAS]
+        for database in databases:
+            self.stdout.write(f"migrating {database}")
+            call_command(
+                "migrate",
+                database=database,
+                interactive=options["interactive"],
+                verbosity=options["verbosity"],
+                stdout=self.stdout,
+            )
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chat.tasks import run_pending
+
+
+class Command(BaseCommand):
+    help = "Run the pending outbox tasks (side effects of message and room writes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--interval", type=float, default=1.0, help="seconds between polls"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="run the due tasks and exit"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = run_pending(options["batch_size"])
+            if count:
+                self.stdout.write(f"ran {count} tasks")
+            if options["once"]:
+                break
+            # keep draining while there is a backlog
+            if count < options["batch_size"]:
+                time.sleep(options["interval"])
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.9 on 2026-10-19 17:08
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+
+def add_existing_rooms(apps, schema_editor):
+    # rooms created before sharding stay on the database they are in
+    Room = apps.get_model('chat', 'Room')
+    RoomDirectory = apps.get_model('chat', 'RoomDirectory')
+    db_alias = schema_editor.connection.alias
+    RoomDirectory.objects.using(db_alias).bulk_create(
+        RoomDirectory(id=room_id, shard=db_alias)
+        for room_id in Room.objects.using(db_alias).values_list('id', flat=True)
+    )
+    # new ids have to start after the existing rooms
+    for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [RoomDirectory]):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_outboxtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomDirectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.RunPython(
+            add_existing_rooms,
+            migrations.RunPython.noop,
+            hints={'model_name': 'roomdirectory'},
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.9 on 2026-10-19 18:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_receipts(apps, schema_editor):
+    # concurrent first reads could create two receipts for the same member,
+    # the one that has read the furthest is kept
+    ReadReceipt = apps.get_model('chat', 'ReadReceipt')
+    receipts = ReadReceipt.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        receipts.values('room_id', 'user_id')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        kept = (
+            receipts.filter(room_id=duplicate['room_id'], user_id=duplicate['user_id'])
+            .order_by('-last_read_message', 'id')
+            .first()
+        )
+        receipts.filter(
+            room_id=duplicate['room_id'], user_id=duplicate['user_id']
+        ).exclude(pk=kept.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_roomdirectory'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_receipts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='readreceipt',
+            constraint=models.UniqueConstraint(fields=('room', 'user'), name='unique_read_receipt'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.9 on 2026-10-19 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0004_readreceipt_unique_read_receipt'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='author',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='readreceipt',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='room_owner', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='users',
+            field=models.ManyToManyField(db_constraint=False, related_name='room_users', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.2.9 on 2026-10-19 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+# every shard hands out message ids from its own range, so ids are unique
+# across shards while still growing within a room. 2**40 ids per shard keeps
+# them below 2**53 for the javascript clients up to 8192 shards
+MESSAGE_ID_RANGE = 2**40
+
+
+def start_message_ids(apps, schema_editor):
+    # the range is the position of the shard in CHAT_SHARDS, which is why
+    # shards are only ever appended to it. ids handed out before are kept
+    connection = schema_editor.connection
+    if connection.alias not in settings.CHAT_SHARDS:
+        return
+    start = settings.CHAT_SHARDS.index(connection.alias) * MESSAGE_ID_RANGE
+    if start == 0:
+        return
+
+    table = apps.get_model('chat', 'Message')._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                'UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s',
+                [start, table],
+            )
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                    [table, start],
+                )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT setval(pg_get_serial_sequence(%s, %s), '
+                'GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {})))'.format(
+                    schema_editor.quote_name(table)
+                ),
+                [table, 'id', start],
+            )
+        elif connection.vendor == 'mysql':
+            # never moves below the ids already in the table
+            cursor.execute(
+                'ALTER TABLE {} AUTO_INCREMENT = {:d}'.format(
+                    schema_editor.quote_name(table), start + 1
+                )
+            )
+        else:
+            raise NotImplementedError(f'message id ranges on {connection.vendor}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_users_on_default'),
+    ]
+
+    operations = [
+        # receipts hold message ids, which no longer fit in 32 bits
+        migrations.AlterField(
+            model_name='readreceipt',
+            name='last_read_message',
+            field=models.BigIntegerField(),
+        ),
+        migrations.RunPython(start_message_ids, migrations.RunPython.noop),
+    ]
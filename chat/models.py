@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from chat.sharding import allocate_room, shard_for_room
 
 
 class BaseModel(models.Model):
@@ -10,32 +13,97 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class ShardedModel(models.Model):
+    # always saved on the shard of its room, see chat.sharding
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        kwargs["using"] = shard_for_room(self.room_id)
+        super().save(*args, **kwargs)
+
+
+class RoomDirectory(models.Model):
+    # hands out the room ids and remembers the shard of every room
+    # lives on the default database only
+    shard = models.CharField(max_length=100)
+
+    def __str__(self):
+        return f"{self.id} - {self.shard}"
+
+
 class Room(BaseModel):
     # title is used for group chats
     # for Personal Chat ther is no title
     title = models.CharField(max_length=120, null=True, blank=True)
+    # users stay on the default database, so no constraint across shards
     created_by = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="room_owner"
+        User, on_delete=models.CASCADE, related_name="room_owner", db_constraint=False
     )
-    users = models.ManyToManyField(User, related_name="room_users")
+    users = models.ManyToManyField(User, related_name="room_users", db_constraint=False)
 
     def __str__(self):
         return f"{self.id} - {self.title}"
 
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            self.pk = allocate_room()
+        kwargs["using"] = shard_for_room(self.pk)
+        super().save(*args, **kwargs)
+
+    def member_ids(self):
+        # room.users.all() would join the users table, which is not on the shard
+        return list(
+            Room.users.through.objects.using(self._state.db)
+            .filter(room=self)
+            .values_list("user_id", flat=True)
+        )
 
-class Message(BaseModel):
+
+class Message(ShardedModel, BaseModel):
     content = models.TextField()
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
-    author = models.ForeignKey(User, on_delete=models.CASCADE)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
 
     def __str__(self):
         return f"{self.author} - {self.created_at}"
 
 
-class ReadReceipt(models.Model):
+class ReadReceipt(ShardedModel):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    last_read_message = models.IntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    last_read_message = models.BigIntegerField()
+
+    class Meta:
+        # one receipt per member, concurrent first reads can not duplicate it
+        constraints = [
+            models.UniqueConstraint(fields=["room", "user"], name="unique_read_receipt")
+        ]
 
     def __str__(self):
         return str(self.user)
+
+
+class OutboxTask(BaseModel):
+    # side effects of the writes waiting to be run by the task workers
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    )
+
+    name = models.CharField(max_length=120)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "available_at"])]
+
+    def __str__(self):
+        return f"{self.id} - {self.name}"
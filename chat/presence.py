@@ -0,0 +1,120 @@
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+# presence and typing are ephemeral, they never touch the database
+# every entry expires on its own once the client stops refreshing it
+
+
+class LocalPresenceBackend:
+    """
+    keeps the entries in the memory of the current process
+    only useful with a single worker (development, tests)
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = Lock()
+
+    def set(self, key: str, value, ttl: float):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, entries: dict, ttl: float):
+        with self.lock:
+            expires_at = time.monotonic() + ttl
+            for key, value in entries.items():
+                self.entries[key] = (value, expires_at)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get_many(self, keys) -> dict:
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                value, expires_at = self.entries.get(key, (None, 0))
+                if expires_at > now:
+                    found[key] = value
+                else:
+                    self.entries.pop(key, None)
+        return found
+
+
+class CachePresenceBackend:
+    """
+    keeps the entries in the django cache, every worker pointing to the
+    same cache shares them (the default gchat.cache.SQLiteCache across the
+    processes of one host, memcached across hosts)
+    """
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, "PRESENCE_CACHE", "default")]
+
+    def set(self, key: str, value, ttl: float):
+        self.cache.set(key, value, ttl)
+
+    def set_many(self, entries: dict, ttl: float):
+        self.cache.set_many(entries, ttl)
+
+    def delete(self, key: str):
+        self.cache.delete(key)
+
+    def get_many(self, keys) -> dict:
+        return self.cache.get_many(keys)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        backend_path = getattr(
+            settings, "PRESENCE_BACKEND", "chat.presence.CachePresenceBackend"
+        )
+        _backend = import_string(backend_path)()
+    return _backend
+
+
+def online_key(room_id: int, user_id: int) -> str:
+    return f"presence_online_{room_id}_{user_id}"
+
+
+def typing_key(room_id: int, user_id: int) -> str:
+    return f"presence_typing_{room_id}_{user_id}"
+
+
+def mark_online(room_ids, user_id: int):
+    # called on every poll, so all the rooms are written at once
+    entries = {online_key(room_id, user_id): True for room_id in room_ids}
+    if entries:
+        get_backend().set_many(entries, getattr(settings, "PRESENCE_TTL", 30))
+
+
+def set_typing(room_id: int, user_id: int, typing: bool):
+    backend = get_backend()
+    if typing:
+        backend.set(
+            typing_key(room_id, user_id), True, getattr(settings, "TYPING_TTL", 5)
+        )
+    else:
+        backend.delete(typing_key(room_id, user_id))
+
+
+def room_presence(room_id: int, user_ids) -> dict:
+    # user_ids are the members of the room, the caller already has them
+    keys = {}
+    for user_id in user_ids:
+        keys[online_key(room_id, user_id)] = ("online", user_id)
+        keys[typing_key(room_id, user_id)] = ("typing", user_id)
+
+    presence = {"online": [], "typing": []}
+    for key in get_backend().get_many(list(keys)):
+        kind, user_id = keys[key]
+        presence[kind].append(user_id)
+    return presence
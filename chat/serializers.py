@@ -1,14 +1,20 @@
 from django.contrib.auth.models import User
-from rest_framework import exceptions, serializers
+from django.db import transaction
+from rest_framework import serializers
 
-from chat.models import Message, ReadReceipt, Room
+from chat.models import Message, Room
+from chat.sharding import shard_for_room
+from chat.tasks import enqueue
 from core.serializers import UserDetailSerializer
 
 
 class CreateRoomSerializer(serializers.ModelSerializer):
     title = serializers.CharField(required=False)
     # we will just get list of id (pk) for the user
-    users = serializers.PrimaryKeyRelatedField(many=True, queryset=User.objects.all())
+    # write only, the members are read back through RoomSerializer
+    users = serializers.PrimaryKeyRelatedField(
+        many=True, queryset=User.objects.all(), write_only=True
+    )
     # no need to return so hidden field
     # default value is the current user
     created_by = serializers.HiddenField(default=serializers.CurrentUserDefault())
@@ -17,6 +23,31 @@ class CreateRoomSerializer(serializers.ModelSerializer):
         model = Room
         fields = ("id", "title", "users", "created_by")
 
+    def create(self, validated_data):
+        users = validated_data.pop("users")
+        room = super().create(validated_data)
+        # add() only writes the membership on the shard, set() would also read
+        # the users table, which lives on the default database
+        room.users.add(*users)
+        return room
+
+
+class RoomField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        # the room is looked up on its own shard
+        try:
+            return Room.objects.using(shard_for_room(data)).get(pk=data)
+        except Room.DoesNotExist:
+            self.fail("does_not_exist", pk_value=data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+
+class TypingSerializer(serializers.Serializer):
+    room_id = serializers.IntegerField()
+    # BooleanField reads "false" from a form as False
+    typing = serializers.BooleanField(default=True)
+
 
 class MessageSerializer(serializers.ModelSerializer):
     author = serializers.PrimaryKeyRelatedField(
@@ -30,47 +61,48 @@ class MessageSerializer(serializers.ModelSerializer):
 
 class CreateMessageSerializer(serializers.ModelSerializer):
     author = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    room = RoomField(queryset=Room.objects.all())
 
     class Meta:
         model = Message
         fields = ("id", "content", "author", "room")
 
     def create(self, validated_data):
-        message = super().create(validated_data)
-        read_receipt = None
-        try:
-            read_receipt = ReadReceipt.objects.get(
-                room=message.room, user=message.author
+        # message and its side effects are committed together
+        # the side effects themselves run off the request path
+        shard = validated_data["room"]._state.db
+        with transaction.atomic(using=shard):
+            message = super().create(validated_data)
+            enqueue(
+                "chat.update_read_receipt",
+                shard=shard,
+                room_id=message.room_id,
+                message_id=message.id,
             )
-        except ReadReceipt.DoesNotExist:
-            raise exceptions.NotFound("No read receipt found")
-
-        read_receipt.last_read_message = message.id
-        read_receipt.save()
         return message
 
 
 class RoomSerializer(serializers.ModelSerializer):
     last_read_message = serializers.SerializerMethodField(required=False)
     messages = MessageSerializer(many=True, source="message_set")
-    users = UserDetailSerializer(many=True)
+    users = serializers.SerializerMethodField()
 
     class Meta:
         model = Room
         fields = ("id", "title", "users", "messages", "last_read_message")
 
+    def get_users(self, room):
+        # users live on the default database, the room on its shard
+        users = User.objects.filter(pk__in=room.member_ids())
+        return UserDetailSerializer(users, many=True).data
+
     def get_last_read_message(self, room):
         user = self.context.get("request").user
-        read_receipt = None
-        try:
-            read_receipt = ReadReceipt.objects.get(room=room, user=user)
-        except ReadReceipt.DoesNotExist:
-            # if not read receipt with room and user then creating one
-            # last_read_message is -1 as there won't be any messages
-            read_receipt = ReadReceipt()
-            read_receipt.user = user
-            read_receipt.room = room
-            read_receipt.last_read_message = -1
-            read_receipt.save()
-
+        # if not read receipt with room and user then creating one
+        # last_read_message is -1 as there won't be any messages
+        # get_or_create falls back to a get when a concurrent request
+        # created it first and the unique constraint fails
+        read_receipt, _ = room.readreceipt_set.get_or_create(
+            user=user, defaults={"last_read_message": -1}
+        )
         return read_receipt.last_read_message
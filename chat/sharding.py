@@ -0,0 +1,144 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+
+# a room, its messages, read receipts and members live on the room's shard
+# users and the room directory (id -> shard) live on the default database
+# room ids come from the directory and message ids from a range of their
+# own on every shard (chat 0006), so both are unique across shards
+
+# room id -> shard, rooms never move so this can not go stale
+_room_shards = {}
+
+
+def get_shards():
+    return settings.CHAT_SHARDS
+
+
+def allocate_room():
+    """
+    reserves a room id in the directory and picks its shard
+    ids come from a single table, so they are unique across shards
+    """
+    RoomDirectory = apps.get_model("chat", "RoomDirectory")
+    entry = RoomDirectory.objects.using(DEFAULT_DB_ALIAS).create(
+        shard=random.choice(get_shards())
+    )
+    _room_shards[entry.id] = entry.shard
+    return entry.id
+
+
+def shard_for_room(room_id) -> str:
+    try:
+        room_id = int(room_id)
+    except (TypeError, ValueError):
+        return DEFAULT_DB_ALIAS
+
+    if room_id not in _room_shards:
+        RoomDirectory = apps.get_model("chat", "RoomDirectory")
+        shard = (
+            RoomDirectory.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk=room_id)
+            .values_list("shard", flat=True)
+            .first()
+        )
+        # unknown rooms are looked up (and not found) on default
+        if shard is None:
+            return DEFAULT_DB_ALIAS
+        _room_shards[room_id] = shard
+    return _room_shards[room_id]
+
+
+def group_by_shard(room_ids) -> dict:
+    shards = {}
+    for room_id in room_ids:
+        shards.setdefault(shard_for_room(room_id), []).append(room_id)
+    return shards
+
+
+_executor = None
+_executor_lock = Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=len(get_shards()), thread_name_prefix="chat-shards"
+            )
+    return _executor
+
+
+def _run_on_shard(func, shard):
+    # every thread has its own connections, treat each call like a request
+    close_old_connections()
+    try:
+        return func(shard)
+    finally:
+        close_old_connections()
+
+
+def fan_out(func, shards) -> dict:
+    """
+    runs func(shard) for every shard in parallel, returns {shard: result}
+    a single shard is queried right away without a thread
+    """
+    shards = list(shards)
+    if len(shards) <= 1:
+        return {shard: func(shard) for shard in shards}
+
+    executor = _get_executor()
+    futures = {shard: executor.submit(_run_on_shard, func, shard) for shard in shards}
+    return {shard: future.result() for shard, future in futures.items()}
+
+
+class RoomShardRouter:
+    """
+    sends the queries of a room's rows to the room's shard
+    queries without a room in the hints go to default, so the views pick
+    the shard themselves with .using(shard_for_room(room_id))
+    users are always read from default, also when reached from a shard row
+    (message.author), the auth tables of the shards are empty
+    """
+
+    default_apps = ("auth", "contenttypes")
+
+    def get_room_id(self, hints):
+        instance = hints.get("instance")
+        if instance is None or instance._meta.app_label != "chat":
+            return None
+        if instance._meta.model_name == "room":
+            return instance.pk
+        return getattr(instance, "room_id", None)
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.default_apps:
+            return DEFAULT_DB_ALIAS
+        if model._meta.app_label != "chat":
+            return None
+        room_id = self.get_room_id(hints)
+        if room_id is None:
+            return None
+        return shard_for_room(room_id)
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # users on default are referenced from every shard
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == "chat" and model_name == "roomdirectory":
+            return db == DEFAULT_DB_ALIAS
+        if db == DEFAULT_DB_ALIAS:
+            return None
+        if db in get_shards():
+            # chat 0001 was written with foreign keys to auth_user, the auth
+            # tables are created on the shards for them but stay empty
+            return app_label in ("chat", "auth", "contenttypes")
+        return None
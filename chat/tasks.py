@@ -0,0 +1,171 @@
+import logging
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+from django.utils import timezone
+
+from chat.models import Message, OutboxTask, ReadReceipt, Room
+from chat.sharding import get_shards, shard_for_room
+
+logger = logging.getLogger(__name__)
+
+# name -> function, filled by the @task decorator
+registry = {}
+
+
+def task(name: str):
+    def decorator(func):
+        registry[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name: str, shard: str = DEFAULT_DB_ALIAS, **payload):
+    """
+    schedule a side effect of a write made on the shard
+    TASKS_MODE decides how it runs
+        eager   - run right away on the request path
+        thread  - store in the outbox and run in a thread of this worker
+        outbox  - store in the outbox and leave it to `manage.py run_tasks`
+    the outbox row is written on the same shard and is part of the current
+    transaction, so the task is only visible once the write is committed
+    """
+    mode = getattr(settings, "TASKS_MODE", "thread")
+    if mode == "eager":
+        registry[name](**payload)
+        return None
+
+    outbox_task = OutboxTask.objects.using(shard).create(name=name, payload=payload)
+    if mode == "thread":
+        transaction.on_commit(
+            lambda: _get_worker().put(shard, outbox_task.id), using=shard
+        )
+    return outbox_task
+
+
+def claim(shard: str, task_id: int) -> bool:
+    # the status check makes sure only one worker runs a task
+    claimed = (
+        OutboxTask.objects.using(shard)
+        .filter(pk=task_id, status=OutboxTask.PENDING)
+        .update(status=OutboxTask.RUNNING, updated_at=timezone.now())
+    )
+    return claimed == 1
+
+
+def run_task(shard: str, task_id: int):
+    if not claim(shard, task_id):
+        return
+
+    outbox_task = OutboxTask.objects.using(shard).get(pk=task_id)
+    try:
+        registry[outbox_task.name](**outbox_task.payload)
+    except Exception as error:
+        logger.exception("task %s failed", outbox_task)
+        outbox_task.attempts += 1
+        outbox_task.last_error = repr(error)
+        if outbox_task.attempts >= getattr(settings, "TASKS_MAX_ATTEMPTS", 5):
+            outbox_task.status = OutboxTask.FAILED
+        else:
+            # retry with exponential backoff
+            outbox_task.status = OutboxTask.PENDING
+            outbox_task.available_at = timezone.now() + timedelta(
+                seconds=2**outbox_task.attempts
+            )
+        outbox_task.save()
+    else:
+        outbox_task.delete()
+
+
+def run_pending(batch_size: int = 100) -> int:
+    """
+    run the tasks that are due on every shard, returns how many were picked up
+    tasks left running by a crashed worker are handed out again
+    """
+    count = 0
+    for shard in {DEFAULT_DB_ALIAS, *get_shards()}:
+        count += run_pending_on_shard(shard, batch_size)
+    return count
+
+
+def run_pending_on_shard(shard: str, batch_size: int) -> int:
+    outbox = OutboxTask.objects.using(shard)
+    now = timezone.now()
+    stale_at = now - timedelta(seconds=getattr(settings, "TASKS_LOCK_TIMEOUT", 300))
+    outbox.filter(status=OutboxTask.RUNNING, updated_at__lt=stale_at).update(
+        status=OutboxTask.PENDING
+    )
+
+    task_ids = list(
+        outbox.filter(status=OutboxTask.PENDING, available_at__lte=now)
+        .order_by("available_at")
+        .values_list("id", flat=True)[:batch_size]
+    )
+    for task_id in task_ids:
+        run_task(shard, task_id)
+    return len(task_ids)
+
+
+class Worker(threading.Thread):
+    """
+    runs the outbox tasks of this process in the background
+    anything it misses (restarts, retries) is picked up by run_tasks
+    """
+
+    def __init__(self):
+        super().__init__(name="chat-tasks", daemon=True)
+        self.queue = queue.Queue()
+
+    def put(self, shard: str, task_id: int):
+        self.queue.put((shard, task_id))
+
+    def run(self):
+        while True:
+            shard, task_id = self.queue.get()
+            close_old_connections()
+            try:
+                run_task(shard, task_id)
+            except Exception:
+                logger.exception("worker could not run task %s", task_id)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _get_worker() -> Worker:
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = Worker()
+            _worker.start()
+    return _worker
+
+
+@task("chat.update_read_receipt")
+def update_read_receipt(room_id: int, message_id: int):
+    shard = shard_for_room(room_id)
+    message = Message.objects.using(shard).get(pk=message_id, room=room_id)
+    # author has read everything up to their own message
+    # only move forward, tasks may run out of order
+    ReadReceipt.objects.using(shard).filter(
+        room=message.room_id,
+        user=message.author_id,
+        last_read_message__lt=message.id,
+    ).update(last_read_message=message.id)
+
+
+@task("chat.create_read_receipts")
+def create_read_receipts(room_id: int):
+    room = Room.objects.using(shard_for_room(room_id)).get(pk=room_id)
+    for user_id in room.member_ids():
+        room.readreceipt_set.get_or_create(
+            user_id=user_id, defaults={"last_read_message": -1}
+        )
@@ -1,3 +1,616 @@
-from django.test import TestCase
+import gzip
+import json
+import subprocess
+import sys
+import threading
+from contextlib import nullcontext
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+
+from chat import export, sharding, tasks
+from chat.models import Message, OutboxTask, ReadReceipt, Room, RoomDirectory
+from chat.presence import room_presence, set_typing
+from chat.serializers import RoomSerializer
+from chat.sharding import RoomShardRouter, fan_out, get_shards, shard_for_room
+
+failures = []
+
+
+@tasks.task("test.flaky")
+def flaky(fail: bool):
+    if fail:
+        failures.append(fail)
+        raise RuntimeError("task failed")
+
+
+def create_room(*users, title="room", shard=None):
+    # rooms go to a random shard unless one is given
+    placement = (
+        mock.patch("chat.sharding.random.choice", return_value=shard)
+        if shard
+        else nullcontext()
+    )
+    with placement:
+        room = Room.objects.create(title=title, created_by=users[0])
+    room.users.add(*users)
+    return room
+
+
+class ChatTestMixin:
+    # the shards of gchat.settings_test
+    databases = {"default", "s1", "s2"}
+
+    def setUp(self):
+        cache.clear()
+        # ids are reused once a test is rolled back
+        sharding._room_shards.clear()
+        self.user = User.objects.create_user("user", "user@example.com", "password")
+        self.other = User.objects.create_user("other", "other@example.com", "password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+@override_settings(TASKS_MODE="eager")
+class ChatTestCase(ChatTestMixin, TestCase):
+    pass
+
+
+@override_settings(TASKS_MODE="outbox")
+class OutboxTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        failures.clear()
+
+    def test_eager_mode_runs_right_away(self):
+        with self.settings(TASKS_MODE="eager"):
+            self.assertIsNone(tasks.enqueue("test.flaky", fail=False))
+        self.assertFalse(OutboxTask.objects.exists())
+
+    def test_outbox_mode_waits_for_the_worker(self):
+        outbox_task = tasks.enqueue("test.flaky", fail=False)
+        self.assertEqual(outbox_task.status, OutboxTask.PENDING)
+
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertFalse(OutboxTask.objects.exists())
+
+    def test_task_is_rolled_back_with_the_write(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                tasks.enqueue("test.flaky", fail=False)
+                raise RuntimeError("write failed")
+        self.assertFalse(OutboxTask.objects.exists())
+
+    def test_failed_task_is_retried_with_backoff(self):
+        outbox_task = tasks.enqueue("test.flaky", fail=True)
+
+        before = timezone.now()
+        with self.assertLogs("chat.tasks", "ERROR"):
+            tasks.run_pending()
+        outbox_task.refresh_from_db()
+        self.assertEqual(outbox_task.status, OutboxTask.PENDING)
+        self.assertEqual(outbox_task.attempts, 1)
+        self.assertIn("task failed", outbox_task.last_error)
+        self.assertGreaterEqual(outbox_task.available_at, before + timedelta(seconds=2))
+
+        # not due yet
+        self.assertEqual(tasks.run_pending(), 0)
+
+        OutboxTask.objects.filter(pk=outbox_task.pk).update(available_at=timezone.now())
+        with self.assertLogs("chat.tasks", "ERROR"):
+            tasks.run_pending()
+        outbox_task.refresh_from_db()
+        self.assertEqual(outbox_task.attempts, 2)
+        self.assertGreaterEqual(
+            outbox_task.available_at, timezone.now() + timedelta(seconds=3)
+        )
+
+    @override_settings(TASKS_MAX_ATTEMPTS=2)
+    def test_task_fails_after_max_attempts(self):
+        outbox_task = tasks.enqueue("test.flaky", fail=True)
+        for _ in range(2):
+            OutboxTask.objects.filter(pk=outbox_task.pk).update(
+                available_at=timezone.now()
+            )
+            with self.assertLogs("chat.tasks", "ERROR"):
+                tasks.run_pending()
+
+        outbox_task.refresh_from_db()
+        self.assertEqual(outbox_task.status, OutboxTask.FAILED)
+        self.assertEqual(len(failures), 2)
+        self.assertEqual(tasks.run_pending(), 0)
+
+    def test_stale_running_task_is_picked_up_again(self):
+        outbox_task = tasks.enqueue("test.flaky", fail=False)
+        OutboxTask.objects.filter(pk=outbox_task.pk).update(
+            status=OutboxTask.RUNNING,
+            updated_at=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertFalse(OutboxTask.objects.exists())
+
+    def test_task_is_claimed_once(self):
+        outbox_task = tasks.enqueue("test.flaky", fail=False)
+        self.assertTrue(tasks.claim("default", outbox_task.pk))
+        self.assertFalse(tasks.claim("default", outbox_task.pk))
+
+    def test_new_message_updates_read_receipt(self):
+        room = create_room(self.user, self.other)
+        ReadReceipt.objects.create(room=room, user=self.user, last_read_message=-1)
+
+        response = self.client.post(
+            "/api/chat/new_message/", {"room": room.id, "content": "hi"}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            OutboxTask.objects.using(room._state.db).get().name,
+            "chat.update_read_receipt",
+        )
+
+        tasks.run_pending()
+        receipt = room.readreceipt_set.get(user=self.user)
+        self.assertEqual(receipt.last_read_message, response.data["id"])
+
+
+class AddRoomTest(ChatTestCase):
+    def test_add_room(self):
+        response = self.client.post(
+            "/api/chat/add_room/",
+            {"title": "room", "users": [self.other.id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["last_read_message"], -1)
+
+        room_id = response.data["id"]
+        room = Room.objects.using(shard_for_room(room_id)).get(pk=room_id)
+        self.assertCountEqual(room.member_ids(), [self.user.id, self.other.id])
+        # made by create_read_receipts, eager in the tests
+        self.assertEqual(room.readreceipt_set.count(), 2)
+
+    def test_room_is_rolled_back_with_its_task(self):
+        with mock.patch("chat.views.enqueue", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(
+                    "/api/chat/add_room/",
+                    {"title": "room", "users": [self.other.id]},
+                    format="json",
+                )
+
+        for shard in get_shards():
+            self.assertFalse(Room.objects.using(shard).exists())
+            self.assertFalse(ReadReceipt.objects.using(shard).exists())
+
+
+class ReadReceiptTest(ChatTestCase):
+    def test_one_receipt_per_member(self):
+        room = create_room(self.user)
+        ReadReceipt.objects.create(room=room, user=self.user, last_read_message=-1)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic(using=room._state.db):
+                ReadReceipt.objects.create(
+                    room=room, user=self.user, last_read_message=-1
+                )
+
+    def test_rooms_reuse_the_receipt(self):
+        room = create_room(self.user)
+        for _ in range(2):
+            self.assertEqual(self.serialize(room)["last_read_message"], -1)
+        self.assertEqual(room.readreceipt_set.count(), 1)
+
+    def test_concurrent_creation_falls_back_to_get(self):
+        room = create_room(self.user)
+        receipt = ReadReceipt.objects.create(
+            room=room, user=self.user, last_read_message=3
+        )
+        # the first lookup misses as if another request had not committed yet
+        with mock.patch.object(
+            QuerySet, "get", side_effect=[ReadReceipt.DoesNotExist, receipt]
+        ):
+            self.assertEqual(self.serialize(room)["last_read_message"], 3)
+        self.assertEqual(room.readreceipt_set.count(), 1)
+
+    def serialize(self, room):
+        request = APIRequestFactory().get("/api/chat/rooms/")
+        request.user = self.user
+        return RoomSerializer(room, context={"request": request}).data
+
+
+def run_in_worker(code: str) -> str:
+    # another process of the host, set up from the same settings
+    return subprocess.run(
+        [sys.executable, "manage.py", "shell", "-c", code],
+        cwd=settings.BASE_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+class PresenceTest(ChatTestCase):
+    def poll(self, room, **data):
+        return self.client.post(
+            "/api/chat/get_new_messages/",
+            {"room_list": [{"room_id": room.id, "last_message": -1}], **data},
+            format="json",
+        )
+
+    def test_every_poll_marks_online(self):
+        room = create_room(self.user, self.other)
+        response = self.poll(room)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(str(room.id), response.json())
+        self.assertEqual(
+            room_presence(room.id, room.member_ids())["online"], [self.user.id]
+        )
+
+    def test_presence_changes_the_response_shape(self):
+        room = create_room(self.user, self.other)
+        set_typing(room.id, self.other.id, True)
+
+        response = self.poll(room, presence=True).json()
+        self.assertEqual(response["messages"], {str(room.id): []})
+        self.assertEqual(
+            response["presence"][str(room.id)],
+            {"online": [self.user.id], "typing": [self.other.id]},
+        )
+
+    def test_typing_outside_the_room(self):
+        room = create_room(self.other)
+        response = self.client.post(
+            "/api/chat/typing/", {"room_id": room.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_form_encoded_false_stops_typing(self):
+        room = create_room(self.user, self.other)
+        set_typing(room.id, self.user.id, True)
+        response = self.client.post(
+            "/api/chat/typing/", {"room_id": room.id, "typing": "false"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(room_presence(room.id, room.member_ids())["typing"], [])
+
+    def test_typing_is_validated(self):
+        room = create_room(self.user, self.other)
+        response = self.client.post(
+            "/api/chat/typing/", {"room_id": room.id, "typing": "maybe"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("typing", response.json())
+
+    @override_settings(
+        REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            "DEFAULT_THROTTLE_RATES": {"typing": "1/min"},
+        }
+    )
+    def test_typing_throttled(self):
+        room = create_room(self.user, self.other)
+        data = {"room_id": room.id}
+        self.assertEqual(self.client.post("/api/chat/typing/", data).status_code, 200)
+        self.assertEqual(self.client.post("/api/chat/typing/", data).status_code, 429)
+
+    def test_processes_share_presence(self):
+        run_in_worker("from chat.presence import mark_online; mark_online([1], 7)")
+        self.assertEqual(room_presence(1, [7, 8]), {"online": [7], "typing": []})
+
+        set_typing(1, 8, True)
+        output = run_in_worker(
+            "import json; from chat.presence import room_presence; "
+            "print(json.dumps(room_presence(1, [7, 8])))"
+        )
+        self.assertEqual(json.loads(output), {"online": [7], "typing": [8]})
+
+
+class ExportTest(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rooms = [
+            create_room(self.user, self.other, title=f"room {i}") for i in range(3)
+        ]
+        for room in self.rooms:
+            for content in ("hello", "there"):
+                Message.objects.create(room=room, author=self.other, content=content)
+        # not a member, must not be exported
+        create_room(self.other, title="private")
+
+    def read_lines(self, content: bytes):
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    def test_streams_ndjson(self):
+        response = self.client.get("/api/chat/export/")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn("gchat-export.ndjson", response["Content-Disposition"])
+
+        records = self.read_lines(b"".join(response.streaming_content))
+        self.assertEqual(records[0]["type"], "user")
+        self.assertEqual(records[0]["id"], self.user.id)
+
+        rooms = [record for record in records if record["type"] == "room"]
+        self.assertCountEqual(
+            [room["id"] for room in rooms], [room.id for room in self.rooms]
+        )
+        self.assertCountEqual(rooms[0]["users"], [self.user.id, self.other.id])
+
+        messages = [record for record in records if record["type"] == "message"]
+        self.assertEqual(len(messages), 6)
+        # every room is followed by its own messages
+        room_id = None
+        for record in records[1:]:
+            if record["type"] == "room":
+                room_id = record["id"]
+            else:
+                self.assertEqual(record["room"], room_id)
+                self.assertEqual(set(record), {"type", *export.MESSAGE_KEYS})
+
+    def test_streams_gzip(self):
+        plain = b"".join(self.client.get("/api/chat/export/").streaming_content)
+        response = self.client.get("/api/chat/export/", {"gzip": "true"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn("gchat-export.ndjson.gz", response["Content-Disposition"])
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), plain)
+
+    def test_chunk_size_does_not_change_the_export(self):
+        self.assertEqual(
+            list(export.export_user(self.user, chunk_size=1)),
+            list(export.export_user(self.user)),
+        )
+
+    def test_buffered(self):
+        lines = [b"a" * 10] * 5
+        chunks = list(export.buffered(lines, size=25))
+        self.assertEqual([len(chunk) for chunk in chunks], [30, 20])
+        self.assertEqual(b"".join(chunks), b"".join(lines))
+
+    @override_settings(
+        REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            "DEFAULT_THROTTLE_RATES": {"export": "1/hour"},
+        }
+    )
+    def test_throttled(self):
+        self.assertEqual(self.client.get("/api/chat/export/").status_code, 200)
+        self.assertEqual(self.client.get("/api/chat/export/").status_code, 429)
+
+    def test_command(self):
+        plain = b"".join(export.export_user(self.user))
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / "export.ndjson.gz"
+            call_command("export_user", self.user.email, "-o", str(path), "--gzip")
+            self.assertEqual(gzip.decompress(path.read_bytes()), plain)
+
+        with self.assertRaises(CommandError):
+            call_command("export_user", "nobody@example.com")
+
+
+class ShardingTest(ChatTestCase):
+    def test_room_lives_on_its_shard(self):
+        room = create_room(self.user, self.other, shard="s1")
+        message = Message.objects.create(room=room, author=self.user, content="hi")
+        receipt = ReadReceipt.objects.create(
+            room=room, user=self.user, last_read_message=message.id
+        )
+
+        self.assertEqual(
+            RoomDirectory.objects.using("default").get(pk=room.id).shard, "s1"
+        )
+        self.assertEqual(shard_for_room(room.id), "s1")
+        for instance in (room, message, receipt):
+            self.assertEqual(instance._state.db, "s1")
+        for shard in ("default", "s2"):
+            self.assertFalse(Room.objects.using(shard).exists())
+            self.assertFalse(Message.objects.using(shard).exists())
+        self.assertCountEqual(room.member_ids(), [self.user.id, self.other.id])
+
+    def test_ids_are_unique_across_shards(self):
+        rooms = [create_room(self.user, shard=shard) for shard in get_shards()]
+        self.assertEqual(len({room.id for room in rooms}), 3)
+
+        # every shard hands out message ids from its own range
+        for index, room in enumerate(rooms):
+            message = Message.objects.create(room=room, author=self.user, content="")
+            self.assertEqual(message.id // 2**40, index)
+
+    def test_users_are_read_from_default(self):
+        room = create_room(self.user, self.other, shard="s1")
+        message = Message.objects.create(room=room, author=self.user, content="hi")
+        ReadReceipt.objects.create(
+            room=room, user=self.other, last_read_message=message.id
+        )
+
+        # fresh rows, nothing cached on the instances
+        message = Message.objects.using("s1").get(pk=message.pk)
+        self.assertEqual(message.author, self.user)
+        self.assertEqual(message.room.created_by, self.user)
+        self.assertTrue(str(message).startswith(str(self.user)))
+        receipt = ReadReceipt.objects.using("s1").get(room=room)
+        self.assertEqual(str(receipt), str(self.other))
+
+    def test_migrate_shards(self):
+        with mock.patch(
+            "chat.management.commands.migrate_shards.call_command"
+        ) as migrate:
+            call_command("migrate_shards", "--noinput", stdout=StringIO())
+        self.assertEqual(
+            [call.kwargs["database"] for call in migrate.call_args_list],
+            ["default", "s1", "s2"],
+        )
+
+    def test_shard_needs_a_database_url(self):
+        result = subprocess.run(
+            [sys.executable, "-c", "import gchat.settings_common"],
+            cwd=settings.BASE_DIR,
+            env={"PATH": "", "CHAT_SHARDS": "default,s9"},
+            capture_output=True,
+            text=True,
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("S9_DATABASE_URL is not set", result.stderr)
+
+    def test_unknown_room_is_looked_up_on_default(self):
+        self.assertEqual(shard_for_room(12345), "default")
+        self.assertEqual(shard_for_room("not a room"), "default")
+
+    def test_router(self):
+        router = RoomShardRouter()
+        room = create_room(self.user, shard="s2")
+        message = Message.objects.create(room=room, author=self.user, content="hi")
+
+        self.assertEqual(router.db_for_read(Room, instance=room), "s2")
+        self.assertEqual(router.db_for_write(Message, instance=message), "s2")
+        # without a room the view picks the shard
+        self.assertIsNone(router.db_for_read(Message))
+        self.assertEqual(router.db_for_read(User, instance=message), "default")
+
+        self.assertTrue(router.allow_migrate("default", "chat", "roomdirectory"))
+        self.assertFalse(router.allow_migrate("s1", "chat", "roomdirectory"))
+        self.assertTrue(router.allow_migrate("s1", "chat", "message"))
+        self.assertTrue(router.allow_migrate("s1", "auth", "user"))
+        self.assertFalse(router.allow_migrate("s1", "admin", "logentry"))
+        self.assertIsNone(router.allow_migrate("default", "admin", "logentry"))
+
+    def test_fan_out(self):
+        def thread_name(shard):
+            return threading.current_thread().name
+
+        names = fan_out(thread_name, get_shards())
+        self.assertEqual(set(names), set(get_shards()))
+        self.assertTrue(all(name.startswith("chat-shards") for name in names.values()))
+
+        # a single shard is queried without a thread
+        self.assertEqual(
+            fan_out(thread_name, ["s1"]), {"s1": threading.current_thread().name}
+        )
+
+
+class CrossShardViewTest(ChatTestMixin, TransactionTestCase):
+    # the shards are queried from other threads, which can only see
+    # committed rows, so the tests can not run in a transaction
+
+    def setUp(self):
+        super().setUp()
+        self.rooms = []
+        for shard in get_shards():
+            room = create_room(self.user, self.other, title=shard, shard=shard)
+            for content in ("hello", "there"):
+                Message.objects.create(room=room, author=self.other, content=content)
+            self.rooms.append(room)
+
+    def poll(self, last_messages):
+        return self.client.post(
+            "/api/chat/get_new_messages/",
+            {
+                "room_list": [
+                    {"room_id": room_id, "last_message": last_message}
+                    for room_id, last_message in last_messages.items()
+                ]
+            },
+            format="json",
+        )
+
+    def test_rooms(self):
+        # not a member, not listed
+        create_room(self.other, shard="s1")
+
+        response = self.client.get("/api/chat/rooms/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [room["id"] for room in response.data], [room.id for room in self.rooms]
+        )
+        for room in response.data:
+            self.assertEqual(len(room["messages"]), 2)
+            self.assertEqual(room["last_read_message"], -1)
+            self.assertCountEqual(
+                [user["id"] for user in room["users"]], [self.user.id, self.other.id]
+            )
+
+    def test_get_new_messages(self):
+        first = Message.objects.using("s2").filter(room=self.rooms[2]).first()
+        response = self.poll(
+            {self.rooms[0].id: -1, self.rooms[1].id: -1, self.rooms[2].id: first.id}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(len(data[str(self.rooms[0].id)]), 2)
+        self.assertEqual(len(data[str(self.rooms[1].id)]), 2)
+        self.assertEqual(
+            [message["content"] for message in data[str(self.rooms[2].id)]],
+            ["there"],
+        )
+
+    def test_get_new_messages_of_another_room(self):
+        room = create_room(self.other, shard="s2")
+        Message.objects.create(room=room, author=self.other, content="secret")
+
+        response = self.poll({self.rooms[1].id: -1, room.id: -1})
+        self.assertEqual(response.status_code, 405)
+
+    def test_mark_as_read(self):
+        room = self.rooms[2]
+        message = Message.objects.using("s2").filter(room=room).last()
+        ReadReceipt.objects.create(room=room, user=self.user, last_read_message=-1)
+
+        response = self.client.post(
+            "/api/chat/mark_as_read/",
+            {"room_id": room.id, "last_read_message": message.id},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            ReadReceipt.objects.using("s2").get(room=room).last_read_message,
+            message.id,
+        )
+
+    def test_mark_as_read_message_of_another_room(self):
+        message = Message.objects.using("s1").filter(room=self.rooms[1]).last()
+        response = self.client.post(
+            "/api/chat/mark_as_read/",
+            {"room_id": self.rooms[2].id, "last_read_message": message.id},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class RoomDirectoryMigrationTest(TransactionTestCase):
+    migrate_from = [("chat", "0002_outboxtask")]
+    migrate_to = [("chat", "0003_roomdirectory")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes("chat"))
+
+    def test_existing_rooms_stay_on_default(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        old_apps = executor.loader.project_state(self.migrate_from).apps
+        user = old_apps.get_model("auth", "User").objects.create(username="user")
+        Room = old_apps.get_model("chat", "Room")
+        room_ids = [Room.objects.create(created_by=user).id for _ in range(2)]
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        new_apps = executor.loader.project_state(self.migrate_to).apps
+        RoomDirectory = new_apps.get_model("chat", "RoomDirectory")
+
+        self.assertEqual(
+            list(RoomDirectory.objects.values_list("id", "shard")),
+            [(room_id, "default") for room_id in room_ids],
+        )
+        # new rooms get ids after the existing ones
+        self.assertGreater(RoomDirectory.objects.create(shard="s1").id, room_ids[-1])
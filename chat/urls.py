@@ -2,10 +2,12 @@ from django.urls import path
 
 from chat.views import (
     AddRoomView,
+    ExportView,
     MarkAsReadView,
     MessageCreateView,
     NewMessagesListView,
     RoomListView,
+    TypingView,
 )
 
 urlpatterns = [
@@ -14,4 +16,6 @@ urlpatterns = [
     path("new_message/", MessageCreateView.as_view()),
     path("get_new_messages/", NewMessagesListView.as_view()),
     path("mark_as_read/", MarkAsReadView.as_view()),
+    path("typing/", TypingView.as_view()),
+    path("export/", ExportView.as_view()),
 ]
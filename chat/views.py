@@ -1,14 +1,33 @@
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from rest_framework import exceptions, permissions, generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from chat.export import buffered, export_user, gzip_stream
 from chat.models import Message, ReadReceipt, Room
+from chat.presence import mark_online, room_presence, set_typing
+from chat.sharding import (
+    allocate_room,
+    fan_out,
+    get_shards,
+    group_by_shard,
+    shard_for_room,
+)
 from chat.serializers import (
     CreateRoomSerializer,
     CreateMessageSerializer,
     MessageSerializer,
     RoomSerializer,
+    TypingSerializer,
+)
+from chat.tasks import enqueue
+from gchat.throttling import (
+    ExportRateThrottle,
+    MessageRateThrottle,
+    PollRateThrottle,
+    TypingRateThrottle,
 )
 
 
@@ -19,15 +38,19 @@ class AddRoomView(generics.CreateAPIView):
 
     def create(self, request, *args, **kwargs):
         user = request.user
-        # create room with default serializer
-        room = super().create(request, *args, **kwargs)
-        # get the room and add our user to it
-        room_id = room.data.get("id")
-        room = Room.objects.get(pk=room_id)
-        room.users.add(user)
-        room.save()
-        # now return the serialized response same as list room
-        room_serialized = RoomSerializer(room, context={"request": request}).data
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # the id is reserved first to know the shard, then the room, its
+        # members, the read receipt and the outbox task are committed together
+        room_id = allocate_room()
+        with transaction.atomic(using=shard_for_room(room_id)):
+            # create room with default serializer and add our user to it
+            room = serializer.save(id=room_id)
+            room.users.add(user)
+            # now return the serialized response same as list room
+            room_serialized = RoomSerializer(room, context={"request": request}).data
+            # after serializing, which already made the read receipt of our user
+            enqueue("chat.create_read_receipts", shard=room._state.db, room_id=room.id)
         return Response(room_serialized)
 
 
@@ -38,18 +61,33 @@ class RoomListView(generics.ListAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        rooms = user.room_users.all()
-        return rooms
+
+        # rooms are spread over the shards, all of them are asked in parallel
+        def get_rooms(shard):
+            rooms = (
+                Room.objects.using(shard)
+                .filter(users=user.id)
+                .prefetch_related("message_set")
+            )
+            return list(rooms)
+
+        rooms = fan_out(get_rooms, get_shards())
+        return sorted(
+            (room for shard_rooms in rooms.values() for room in shard_rooms),
+            key=lambda room: room.id,
+        )
 
 
 class MessageCreateView(generics.CreateAPIView):
     queryset = Message.objects.all()
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = CreateMessageSerializer
+    throttle_classes = (MessageRateThrottle,)
 
 
 class NewMessagesListView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (PollRateThrottle,)
 
     def post(self, request):
         user = request.user
@@ -71,26 +109,110 @@ class NewMessagesListView(APIView):
         ):
             raise exceptions.ValidationError("Invalid Format")
 
+        last_messages = {
+            room.get("room_id"): room.get("last_message") for room in room_list
+        }
+
+        # each shard is asked for its rooms in parallel
+        def get_new_messages(shard):
+            room_ids = rooms_by_shard[shard]
+            members = {}
+            for room_id, user_id in (
+                Room.users.through.objects.using(shard)
+                .filter(room_id__in=room_ids)
+                .values_list("room_id", "user_id")
+            ):
+                members.setdefault(room_id, []).append(user_id)
+
+            new_messages = {
+                room_id: list(
+                    Message.objects.using(shard)
+                    .filter(room=room_id)
+                    .filter(id__gt=last_messages[room_id])
+                )
+                for room_id in room_ids
+            }
+            return members, new_messages
+
+        rooms_by_shard = group_by_shard(last_messages)
+        members = {}
         response = {}
+        for shard_members, shard_messages in fan_out(
+            get_new_messages, rooms_by_shard
+        ).values():
+            members.update(shard_members)
+            for room_id, new_messages in shard_messages.items():
+                # check if current user belongs to the room
+                if len(new_messages) > 0 and user.id not in members.get(
+                    new_messages[0].room_id, []
+                ):
+                    raise exceptions.MethodNotAllowed("Not your room")
+
+                new_messages = MessageSerializer(new_messages, many=True)
+                response[room_id] = new_messages.data
+
+        # polling is what keeps a user online in their rooms, whatever the
+        # client asks for, so older clients still show up to the others
+        user_rooms = [room_id for room_id, users in members.items() if user.id in users]
+        mark_online(user_rooms, user.id)
+
+        # clients asking for presence get {"messages": ..., "presence": ...}
+        if request.data.get("presence"):
+            response = {
+                "messages": response,
+                "presence": {
+                    room_id: room_presence(room_id, members[room_id])
+                    for room_id in user_rooms
+                },
+            }
 
-        for room in room_list:
-            room_id = room.get("room_id")
-            last_message = room.get("last_message")
-            new_messages = (
-                Message.objects.prefetch_related("room")
-                .prefetch_related("room__users")
-                .filter(room=room_id)
-                .filter(id__gt=last_message)
-                .all()
-            )
-            # check if current user belongs to the room
-            if len(new_messages) > 0 and user not in new_messages[0].room.users.all():
-                raise exceptions.MethodNotAllowed("Not your room")
+        return Response(response)
 
-            new_messages = MessageSerializer(new_messages, many=True)
-            response[room_id] = new_messages.data
 
-        return Response(response)
+class TypingView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    # sent on keystrokes, so it has a bucket of its own
+    throttle_classes = (TypingRateThrottle,)
+
+    def post(self, request):
+        user = request.user
+
+        serializer = TypingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        room_id = serializer.validated_data["room_id"]
+
+        is_member = (
+            Room.users.through.objects.using(shard_for_room(room_id))
+            .filter(room_id=room_id, user_id=user.id)
+            .exists()
+        )
+        if not is_member:
+            raise exceptions.NotFound("Room not found")
+
+        set_typing(room_id, user.id, serializer.validated_data["typing"])
+        return Response("done")
+
+
+class ExportView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    throttle_classes = (ExportRateThrottle,)
+
+    def get(self, request):
+        # streamed as NDJSON, the history is never held in memory as a whole
+        # ?gzip=true sends it as a .ndjson.gz file
+        lines = export_user(request.user)
+        if request.query_params.get("gzip") == "true":
+            response = StreamingHttpResponse(
+                gzip_stream(lines), content_type="application/gzip"
+            )
+            filename = "gchat-export.ndjson.gz"
+        else:
+            response = StreamingHttpResponse(
+                buffered(lines), content_type="application/x-ndjson"
+            )
+            filename = "gchat-export.ndjson"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
 
 
 class MarkAsReadView(APIView):
@@ -107,15 +229,17 @@ class MarkAsReadView(APIView):
 
         room = None
         message = None
+        shard = shard_for_room(room_id)
         try:
-            room = Room.objects.get(pk=room_id)
-            message = Message.objects.get(pk=last_read_message)
+            room = Room.objects.using(shard).get(pk=room_id)
+            # the message has to be one of the room's
+            message = Message.objects.using(shard).get(pk=last_read_message, room=room)
         except (Room.DoesNotExist, Message.DoesNotExist):
             raise exceptions.NotFound("Room or Message not found")
 
         read_receipt = None
         try:
-            read_receipt = ReadReceipt.objects.get(room=room, user=user)
+            read_receipt = room.readreceipt_set.get(user=user)
         except ReadReceipt.DoesNotExist:
             raise ValidationError("Read Receipt not found")
 
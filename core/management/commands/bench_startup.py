@@ -0,0 +1,73 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# runs in a fresh interpreter so that nothing is imported yet
+PROBE = """
+import json, os, resource, time
+
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+import_time = time.perf_counter() - start
+
+from django.test import Client
+start = time.perf_counter()
+# unauthenticated, so the request never reaches the database
+status = Client(HTTP_HOST="localhost").get("/api/auth/me/").status_code
+first_request = time.perf_counter() - start
+
+from django.conf import settings
+print(json.dumps({
+    "import_ms": import_time * 1000,
+    "first_request_ms": first_request * 1000,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(__import__("sys").modules),
+    "apps": len(settings.INSTALLED_APPS),
+    "status": status,
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Benchmark worker boot: import time, first request latency and RSS"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profiles",
+            nargs="+",
+            default=["gchat.settings", "gchat.settings_api"],
+            help="settings modules to compare",
+        )
+        parser.add_argument("--runs", type=int, default=5)
+
+    def handle(self, *args, **options):
+        for profile in options["profiles"]:
+            runs = [self.probe(profile) for _ in range(options["runs"])]
+            median = {
+                key: statistics.median(run[key] for run in runs)
+                for key in ("import_ms", "first_request_ms", "rss_mb", "modules")
+            }
+            self.stdout.write(
+                f"{profile:>20}: import {median['import_ms']:.1f}ms  "
+                f"first request {median['first_request_ms']:.1f}ms  "
+                f"rss {median['rss_mb']:.1f}MB  "
+                f"modules {median['modules']:.0f}  apps {runs[0]['apps']}"
+            )
+
+    def probe(self, profile):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": profile}
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=settings.BASE_DIR,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        return json.loads(output.splitlines()[-1])
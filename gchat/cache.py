@@ -0,0 +1,153 @@
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """
+    cache in a local sqlite file, shared by every process of the host
+
+    add() and incr() run in a write transaction, so unlike the file based
+    cache they are atomic across gunicorn workers, which the throttles and
+    the concurrency limiter rely on. For several hosts use memcached instead.
+    LOCATION is the path of the file, it is created when missing.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.location = str(location)
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            # autocommit, transactions are opened explicitly
+            connection = sqlite3.connect(self.location, timeout=5, isolation_level=None)
+            # the entries are ephemeral, no need to wait for the disk
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+            self.local.connection = connection
+        return connection
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _expires(self, timeout):
+        # None never expires, get_backend_timeout gives the absolute time
+        return self.get_backend_timeout(timeout)
+
+    def _select(self, key, now):
+        return self.connection.execute(
+            "SELECT value FROM cache WHERE key = ? "
+            "AND (expires IS NULL OR expires > ?)",
+            (key, now),
+        ).fetchone()
+
+    def get(self, key, default=None, version=None):
+        row = self._select(self._key(key, version), time.time())
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (self._key(key, version), pickle.dumps(value), self._expires(timeout)),
+        )
+
+    def get_many(self, keys, version=None):
+        # presence reads every member of a room at once, in a single query
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        rows = self.connection.execute(
+            "SELECT key, value FROM cache WHERE key IN (%s) "
+            "AND (expires IS NULL OR expires > ?)" % ", ".join("?" * len(keys)),
+            (*keys, time.time()),
+        )
+        return {keys[key]: pickle.loads(value) for key, value in rows}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expires(timeout)
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (
+                    (self._key(key, version), pickle.dumps(value), expires)
+                    for key, value in data.items()
+                ),
+            )
+        finally:
+            connection.execute("COMMIT")
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "DELETE FROM cache WHERE key = ? AND expires <= ?", (key, time.time())
+            )
+            added = connection.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, pickle.dumps(value), self._expires(timeout)),
+            ).rowcount
+        finally:
+            connection.execute("COMMIT")
+        return added == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._select(key, time.time())
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            # the expiry of the key is kept
+            connection.execute(
+                "UPDATE cache SET value = ? WHERE key = ?", (pickle.dumps(value), key)
+            )
+        finally:
+            connection.execute("COMMIT")
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return (
+            self.connection.execute(
+                "UPDATE cache SET expires = ? WHERE key = ? "
+                "AND (expires IS NULL OR expires > ?)",
+                (self._expires(timeout), self._key(key, version), time.time()),
+            ).rowcount
+            == 1
+        )
+
+    def delete(self, key, version=None):
+        return (
+            self.connection.execute(
+                "DELETE FROM cache WHERE key = ?", (self._key(key, version),)
+            ).rowcount
+            == 1
+        )
+
+    def has_key(self, key, version=None):
+        return self._select(self._key(key, version), time.time()) is not None
+
+    def clear(self):
+        self.connection.execute("DELETE FROM cache")
+
+    def close(self, **kwargs):
+        # the connection is kept for the life of the thread
+        pass
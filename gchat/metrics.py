@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# the counters live in the shared cache (CACHES in settings), so every worker
+# of the host adds to the same totals and api/metrics/ reads all of them
+# the names are listed under one key, the cache can not be enumerated
+NAMES_KEY = "metrics_names"
+
+
+def get_cache():
+    return caches[getattr(settings, "METRICS_CACHE", "default")]
+
+
+def counter_key(name: str) -> str:
+    return f"metrics_{name}"
+
+
+def register(cache, name: str):
+    # only runs when a counter is created, the lock key keeps two workers
+    # from dropping each other's names
+    deadline = time.monotonic() + 1
+    while not cache.add(f"{NAMES_KEY}_lock", 1, 1):
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(0.001)
+    try:
+        names = cache.get(NAMES_KEY, [])
+        if name not in names:
+            cache.set(NAMES_KEY, [*names, name], None)
+    finally:
+        cache.delete(f"{NAMES_KEY}_lock")
+
+
+def incr(name: str, value: int = 1):
+    cache = get_cache()
+    try:
+        cache.incr(counter_key(name), value)
+    except ValueError:
+        # first count of this name on the host
+        register(cache, name)
+        cache.add(counter_key(name), 0, None)
+        cache.incr(counter_key(name), value)
+
+
+def snapshot() -> dict:
+    cache = get_cache()
+    names = cache.get(NAMES_KEY, [])
+    values = cache.get_many([counter_key(name) for name in names])
+    return {name: values.get(counter_key(name), 0) for name in names}
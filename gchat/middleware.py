@@ -0,0 +1,78 @@
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from gchat import metrics
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    sheds load with 429 once MAX_CONCURRENT_REQUESTS api requests are
+    being served, so a burst of clients can not pile up on the database
+    connections
+    every request in flight holds one of MAX_CONCURRENT_REQUESTS slot keys
+    in the shared cache, so the limit holds for all the workers of the host
+    together, sync gunicorn workers serve one request each and a per worker
+    limit would never be reached
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = getattr(settings, "CONCURRENCY_LIMIT_PREFIX", "/api/")
+        self.queue_timeout = getattr(settings, "CONCURRENCY_QUEUE_TIMEOUT", 0.1)
+        self.retry_after = getattr(settings, "CONCURRENCY_RETRY_AFTER", 1)
+        limit = getattr(settings, "MAX_CONCURRENT_REQUESTS", 32)
+        self.slot_keys = [f"concurrency_slot_{slot}" for slot in range(limit)]
+        # a worker killed mid request never gives its slot back, the slot
+        # expires after this many seconds, keep it above the gunicorn timeout
+        self.slot_timeout = getattr(settings, "CONCURRENCY_SLOT_TIMEOUT", 60)
+        self.cache = caches[getattr(settings, "CONCURRENCY_CACHE", "default")]
+
+    def acquire(self):
+        """
+        takes a free slot, returns (slot key, owner token) or None
+        the slots in use are read at once, only free ones are written to
+        """
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            taken = self.cache.get_many(self.slot_keys)
+            free = [key for key in self.slot_keys if key not in taken]
+            random.shuffle(free)
+            for key in free:
+                # add is atomic, two requests can not take the same slot
+                if self.cache.add(key, token, self.slot_timeout):
+                    return key, token
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.01)
+
+    def release(self, slot):
+        key, token = slot
+        # a request that outlived its slot must not free the next owner's
+        if self.cache.get(key) == token:
+            self.cache.delete(key)
+
+    def __call__(self, request):
+        # only the api is limited, static files and the frontend are cheap
+        if not request.path.startswith(self.prefix):
+            return self.get_response(request)
+
+        slot = self.acquire()
+        if slot is None:
+            metrics.incr("concurrency.shed")
+            response = JsonResponse(
+                {"detail": "Server is busy, try again later."}, status=429
+            )
+            response["Retry-After"] = str(self.retry_after)
+            return response
+
+        metrics.incr("concurrency.admitted")
+        try:
+            return self.get_response(request)
+        finally:
+            self.release(slot)
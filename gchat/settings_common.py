@@ -0,0 +1,195 @@
+"""
+Django settings shared by every worker profile.
+
+gchat.settings is the full site (api, admin and frontend), gchat.settings_api
+only serves the api/ routes. Nothing heavy is imported here so that the
+api profile can stay lean.
+
+Generated by 'django-admin startproject' using Django 4.0b1.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/dev/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/dev/ref/settings/
+"""
+
+from os import getenv
+from datetime import timedelta
+from pathlib import Path
+from tempfile import gettempdir
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+FRONTEND_DIR = BASE_DIR / "frontend"
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/dev/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = getenv("SECRET_KEY")
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+ALLOWED_HOSTS = []
+
+
+# Application definition
+# only what the api/ routes need, gchat.settings adds the rest of the site
+
+INSTALLED_APPS = [
+    # libraries
+    "rest_framework",
+    "rest_framework_simplejwt",
+    # custom app
+    "core.apps.CoreConfig",
+    "chat.apps.ChatConfig",
+    # default
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+]
+
+MIDDLEWARE = [
+    "django.middleware.security.SecurityMiddleware",
+    "gchat.middleware.ConcurrencyLimitMiddleware",
+    "django.middleware.common.CommonMiddleware",
+]
+
+ROOT_URLCONF = "gchat.urls_api"
+
+TEMPLATES = []
+
+WSGI_APPLICATION = "gchat.wsgi.application"
+
+
+# Database
+# https://docs.djangoproject.com/en/dev/ref/settings/#databases
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+    }
+}
+
+# rooms are spread over these databases, see chat.sharding
+# users and the room directory stay on default, keep "default" listed
+# while it still holds rooms. New shards are only ever appended, the
+# position of a shard picks its range of message ids (chat 0006)
+# run manage.py migrate_shards rather than migrate, it migrates every shard
+CHAT_SHARDS = getenv("CHAT_SHARDS", "default").split(",")
+
+for shard in CHAT_SHARDS:
+    if shard in DATABASES:
+        continue
+    # every shard needs <SHARD>_DATABASE_URL, a local sqlite file would end up
+    # on the ephemeral disk of the dyno and lose its rooms on restart
+    shard_url = getenv(f"{shard.upper()}_DATABASE_URL")
+    if shard_url is None:
+        raise ImproperlyConfigured(
+            f"{shard.upper()}_DATABASE_URL is not set for the {shard} chat shard"
+        )
+    import dj_database_url
+
+    DATABASES[shard] = dj_database_url.parse(shard_url, conn_max_age=600)
+
+DATABASE_ROUTERS = ["chat.sharding.RoomShardRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/dev/topics/cache/
+# the throttles, the concurrency limit and presence keep their state here, so
+# it has to be shared by every worker. gchat.cache.SQLiteCache is shared by
+# the workers of one host, point CACHE_BACKEND and CACHE_LOCATION to
+# memcached when running on several hosts
+
+CACHES = {
+    "default": {
+        "BACKEND": getenv("CACHE_BACKEND", "gchat.cache.SQLiteCache"),
+        "LOCATION": getenv(
+            "CACHE_LOCATION", str(Path(gettempdir()) / "gchat-cache.sqlite3")
+        ),
+    }
+}
+
+
+# Password validation
+# https://docs.djangoproject.com/en/dev/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/dev/topics/i18n/
+
+LANGUAGE_CODE = "en-us"
+
+TIME_ZONE = "UTC"
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/dev/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+AUTHENTICATION_BACKENDS = ["gchat.backend.EmailBackend"]
+
+REST_FRAMEWORK = {
+    "DEFAULT_PERMISSION_CLASSES": [
+        "rest_framework.permissions.IsAuthenticated",
+    ],
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "rest_framework_simplejwt.authentication.JWTAuthentication",
+    ],
+    # token bucket rates, see gchat.throttling
+    "DEFAULT_THROTTLE_RATES": {
+        "poll": getenv("THROTTLE_POLL_RATE", "60/min"),
+        "message": getenv("THROTTLE_MESSAGE_RATE", "30/min"),
+        "export": getenv("THROTTLE_EXPORT_RATE", "5/hour"),
+        "typing": getenv("THROTTLE_TYPING_RATE", "120/min"),
+    },
+}
+
+# gchat.throttling.CacheBucketBackend shares the buckets between workers
+# through CACHES, gchat.throttling.LocalBucketBackend keeps them in memory
+THROTTLE_BACKEND = getenv("THROTTLE_BACKEND", "gchat.throttling.CacheBucketBackend")
+
+# api requests served at once by all the workers before shedding with 429
+MAX_CONCURRENT_REQUESTS = int(getenv("MAX_CONCURRENT_REQUESTS", "32"))
+
+# how the side effects of writes are run, see chat.tasks.enqueue
+TASKS_MODE = getenv("TASKS_MODE", "thread")
+
+# presence and typing live in the cache only, see chat.presence
+# the cache has to be shared between workers, see CACHES
+PRESENCE_BACKEND = getenv("PRESENCE_BACKEND", "chat.presence.CachePresenceBackend")
+
+# seconds a user stays online after a poll and typing after a keystroke
+PRESENCE_TTL = 30
+TYPING_TTL = 5
+
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
+    "REFRESH_TOKEN_LIFETIME": timedelta(days=30),
+}
@@ -0,0 +1,34 @@
+"""
+Django settings for the test suite, the full site with two extra shards.
+
+manage.py picks it for the test command.
+
+    python manage.py test
+"""
+
+from pathlib import Path
+from tempfile import gettempdir
+
+from gchat.settings import *  # noqa: F401,F403
+from gchat.settings import BASE_DIR, DATABASES
+
+CHAT_SHARDS = ["default", "s1", "s2"]
+
+for shard in CHAT_SHARDS[1:]:
+    DATABASES[shard] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"{shard}.sqlite3",
+    }
+
+# a cache of its own, so the tests do not share state with a dev server
+CACHES = {
+    "default": {
+        "BACKEND": "gchat.cache.SQLiteCache",
+        "LOCATION": str(Path(gettempdir()) / "gchat-test-cache.sqlite3"),
+    }
+}
+
+# side effects run on the request path unless a test says otherwise
+TASKS_MODE = "eager"
+
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
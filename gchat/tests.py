@@ -0,0 +1,296 @@
+import multiprocessing
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+from gchat import metrics
+from gchat.cache import SQLiteCache
+from gchat.middleware import ConcurrencyLimitMiddleware
+from gchat.throttling import (
+    CacheBucketBackend,
+    LocalBucketBackend,
+    PollRateThrottle,
+    take_token,
+)
+
+# run in spawned processes, they set django up on their own
+
+
+def incr_many(location, count):
+    shared = SQLiteCache(location, {})
+    for _ in range(count):
+        shared.incr("counter")
+
+
+def add_once(location, _):
+    return SQLiteCache(location, {}).add("lock", 1)
+
+
+def consume_many(count):
+    django.setup()
+    backend = CacheBucketBackend()
+    # wait as long as needed, the test counts tokens and not lock timeouts
+    backend.lock_wait = 5
+    return sum(
+        backend.consume("throttle_test_shared", 50, 0.001)[0] for _ in range(count)
+    )
+
+
+def count_requests(count):
+    django.setup()
+    for _ in range(count):
+        metrics.incr("test.requests")
+
+
+def run_in_processes(func, args):
+    with multiprocessing.get_context("spawn").Pool(len(args)) as pool:
+        return pool.starmap(func, args)
+
+
+class TakeTokenTest(SimpleTestCase):
+    def test_burst_then_throttle(self):
+        bucket = (2, 0)
+        tokens, allowed, _ = take_token(bucket, 0, 2, 1)
+        self.assertTrue(allowed)
+        tokens, allowed, _ = take_token((tokens, 0), 0, 2, 1)
+        self.assertTrue(allowed)
+        tokens, allowed, wait = take_token((tokens, 0), 0, 2, 1)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 1)
+
+    def test_refill_is_capped(self):
+        tokens, allowed, wait = take_token((0, 0), 100, 2, 1)
+        self.assertTrue(allowed)
+        self.assertEqual(tokens, 1)
+        self.assertEqual(wait, 0)
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = str(Path(directory.name) / "cache.sqlite3")
+        self.cache = SQLiteCache(self.location, {})
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.cache.get("key"))
+        self.cache.set("key", {"a": 1})
+        self.assertEqual(self.cache.get("key"), {"a": 1})
+        self.assertTrue(self.cache.delete("key"))
+        self.assertEqual(self.cache.get("key", "default"), "default")
+
+    def test_get_many_set_many(self):
+        self.cache.set_many({"a": 1, "b": 2}, 0.05)
+        self.cache.set("c", 3)
+        self.assertEqual(
+            self.cache.get_many(["a", "b", "c", "d"]), {"a": 1, "b": 2, "c": 3}
+        )
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"c": 3})
+
+    def test_add_only_once(self):
+        self.assertTrue(self.cache.add("key", 1))
+        self.assertFalse(self.cache.add("key", 2))
+        self.assertEqual(self.cache.get("key"), 1)
+
+    def test_expired_keys(self):
+        self.cache.set("key", 1, 0.05)
+        time.sleep(0.1)
+        self.assertFalse(self.cache.has_key("key"))
+        self.assertTrue(self.cache.add("key", 2))
+        self.assertEqual(self.cache.get("key"), 2)
+
+    def test_touch(self):
+        self.cache.set("key", 1, 0.05)
+        self.assertTrue(self.cache.touch("key", 10))
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get("key"), 1)
+
+        self.cache.set("expired", 1, 0.05)
+        time.sleep(0.1)
+        self.assertFalse(self.cache.touch("expired", 10))
+        self.assertIsNone(self.cache.get("expired"))
+
+    def test_incr_keeps_expiry(self):
+        self.cache.set("key", 1, 0.05)
+        self.assertEqual(self.cache.incr("key", 2), 3)
+        self.assertEqual(self.cache.decr("key"), 2)
+        time.sleep(0.1)
+        with self.assertRaises(ValueError):
+            self.cache.incr("key")
+
+    def test_incr_is_atomic_across_processes(self):
+        self.cache.set("counter", 0)
+        run_in_processes(incr_many, [(self.location, 200)] * 4)
+        self.assertEqual(self.cache.get("counter"), 800)
+
+    def test_add_is_atomic_across_processes(self):
+        added = run_in_processes(add_once, [(self.location, i) for i in range(4)])
+        self.assertEqual(added.count(True), 1)
+
+
+class BucketBackendTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_local_backend(self):
+        backend = LocalBucketBackend()
+        results = [backend.consume("key", 3, 0.001)[0] for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+
+    def test_cache_backend_shares_the_bucket_between_processes(self):
+        allowed = run_in_processes(consume_many, [(30,)] * 4)
+        # 120 requests for a bucket of 50 that barely refills
+        self.assertEqual(sum(allowed), 50)
+
+    def test_cache_backend_busy_bucket_is_throttled(self):
+        backend = CacheBucketBackend()
+        backend.lock_wait = 0
+        cache.add("throttle_busy_lock", 1)
+        allowed, wait = backend.consume("throttle_busy", 5, 1)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 1)
+
+
+class PollView(APIView):
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+    throttle_classes = (PollRateThrottle,)
+
+    def get(self, request):
+        return Response("ok")
+
+
+@override_settings(
+    REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        "DEFAULT_THROTTLE_RATES": {"poll": "2/min"},
+    }
+)
+class TokenBucketThrottleTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_throttled_after_burst(self):
+        factory = APIRequestFactory()
+        view = PollView.as_view()
+        statuses = [view(factory.get("/")).status_code for _ in range(2)]
+        self.assertEqual(statuses, [200, 200])
+
+        response = view(factory.get("/"))
+        self.assertEqual(response.status_code, 429)
+        # one token every 30 seconds
+        self.assertEqual(response["Retry-After"], "30")
+
+
+@override_settings(MAX_CONCURRENT_REQUESTS=1, CONCURRENCY_QUEUE_TIMEOUT=0)
+class ConcurrencyLimitMiddlewareTest(SimpleTestCase):
+    slot = "concurrency_slot_0"
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def test_sheds_over_the_limit(self):
+        nested = []
+
+        def get_response(request):
+            # a second request while the first one holds the only slot
+            nested.append(middleware(self.factory.get("/api/chat/rooms/")))
+            return HttpResponse()
+
+        middleware = ConcurrencyLimitMiddleware(get_response)
+        response = middleware(self.factory.get("/api/chat/rooms/"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(nested[0].status_code, 429)
+        self.assertEqual(nested[0]["Retry-After"], "1")
+        # the slot is given back
+        self.assertFalse(cache.has_key(self.slot))
+
+    def test_limit_is_shared_between_workers(self):
+        # another worker of the host is serving a request
+        cache.set(self.slot, "other worker")
+        middleware = ConcurrencyLimitMiddleware(lambda request: HttpResponse())
+        response = middleware(self.factory.get("/api/chat/rooms/"))
+        self.assertEqual(response.status_code, 429)
+
+    def test_only_the_api_is_limited(self):
+        cache.set(self.slot, "other worker")
+        middleware = ConcurrencyLimitMiddleware(lambda request: HttpResponse())
+        response = middleware(self.factory.get("/"))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CONCURRENCY_SLOT_TIMEOUT=0.2)
+    def test_slot_does_not_expire_while_in_flight(self):
+        nested = []
+
+        def get_response(request):
+            # alive past the timeout counted from the previous request
+            time.sleep(0.1)
+            nested.append(middleware(self.factory.get("/api/chat/rooms/")))
+            return HttpResponse()
+
+        middleware = ConcurrencyLimitMiddleware(lambda request: HttpResponse())
+        middleware(self.factory.get("/api/chat/rooms/"))
+        time.sleep(0.15)
+
+        middleware = ConcurrencyLimitMiddleware(get_response)
+        response = middleware(self.factory.get("/api/chat/rooms/"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(nested[0].status_code, 429)
+        self.assertFalse(cache.has_key(self.slot))
+
+    @override_settings(CONCURRENCY_SLOT_TIMEOUT=0.05)
+    def test_expired_request_does_not_free_the_next_owner(self):
+        held = []
+
+        def get_response(request):
+            # outlives its slot, which is handed to the next request
+            time.sleep(0.1)
+            held.append(middleware.acquire())
+            return HttpResponse()
+
+        middleware = ConcurrencyLimitMiddleware(get_response)
+        middleware(self.factory.get("/api/chat/rooms/"))
+
+        self.assertIsNotNone(held[0])
+        self.assertEqual(cache.get(self.slot), held[0][1])
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_counters_are_shared_between_processes(self):
+        run_in_processes(count_requests, [(3,)] * 2)
+        metrics.incr("test.requests")
+        metrics.incr("test.other", 5)
+        self.assertEqual(metrics.snapshot(), {"test.requests": 7, "test.other": 5})
+
+    def test_metrics_view(self):
+        User = get_user_model()
+        client = APIClient()
+        # a throttle decision to report
+        PollView.as_view()(APIRequestFactory().get("/"))
+
+        client.force_authenticate(User.objects.create_user("user"))
+        self.assertEqual(client.get("/api/metrics/").status_code, 403)
+
+        client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        response = client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["throttle.poll.allowed"], 1)
+        self.assertEqual(response.data["concurrency.admitted"], 2)
@@ -0,0 +1,158 @@
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from gchat import metrics
+
+
+def take_token(bucket, now: float, capacity: int, refill_rate: float):
+    tokens, last_refill = bucket
+    tokens = min(capacity, tokens + (now - last_refill) * refill_rate)
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    # seconds until the next token is available
+    wait = 0 if allowed else (1 - tokens) / refill_rate
+    return tokens, allowed, wait
+
+
+class LocalBucketBackend:
+    """
+    keeps the buckets in the memory of the current process
+    every worker gets its own budget, so the limit is per worker
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = Lock()
+
+    def consume(self, key: str, capacity: int, refill_rate: float):
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.buckets.get(key, (capacity, now))
+            tokens, allowed, wait = take_token(bucket, now, capacity, refill_rate)
+            self.buckets[key] = (tokens, now)
+            return allowed, wait
+
+
+class CacheBucketBackend:
+    """
+    keeps the buckets in the django cache so that every worker pointing
+    to the same cache (CACHES in settings) shares one budget per user
+    the read and write of a bucket is guarded by a lock key taken with
+    cache.add, which is atomic in the shared cache, so two workers can
+    not spend the same token
+    """
+
+    # seconds to wait for the lock of a bucket, and how long the lock lives
+    # if a worker dies holding it
+    lock_wait = 0.05
+    lock_timeout = 1
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, "THROTTLE_CACHE", "default")]
+
+    def acquire(self, lock_key: str) -> bool:
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(lock_key, 1, self.lock_timeout):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def consume(self, key: str, capacity: int, refill_rate: float):
+        lock_key = f"{key}_lock"
+        if not self.acquire(lock_key):
+            # the bucket is busy with other requests of the same user
+            return False, 1 / refill_rate
+
+        try:
+            # wall clock is used as the timestamp is shared between processes
+            now = time.time()
+            bucket = self.cache.get(key, (capacity, now))
+            tokens, allowed, wait = take_token(bucket, now, capacity, refill_rate)
+            # a full bucket is the default, so the key can expire once refilled
+            timeout = int(capacity / refill_rate) + 1
+            self.cache.set(key, (tokens, now), timeout)
+            return allowed, wait
+        finally:
+            self.cache.delete(lock_key)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        backend_path = getattr(
+            settings, "THROTTLE_BACKEND", "gchat.throttling.CacheBucketBackend"
+        )
+        _backend = import_string(backend_path)()
+    return _backend
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    token bucket throttle per user and per scope
+    rate is taken from REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"] in the
+    form "<requests>/<period>", the bucket holds <requests> tokens and
+    refills at <requests> per <period>, so short bursts are allowed
+    """
+
+    scope = None
+    durations = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_rate(self):
+        rates = settings.REST_FRAMEWORK.get("DEFAULT_THROTTLE_RATES", {})
+        return rates.get(self.scope)
+
+    def parse_rate(self, rate: str):
+        num, period = rate.split("/")
+        capacity = int(num)
+        return capacity, capacity / self.durations[period[0]]
+
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return f"throttle_{self.scope}_{ident}"
+
+    def allow_request(self, request, view):
+        rate = self.get_rate()
+        if rate is None:
+            return True
+
+        capacity, refill_rate = self.parse_rate(rate)
+        allowed, self.wait_time = get_backend().consume(
+            self.get_ident_key(request), capacity, refill_rate
+        )
+        metrics.incr(f"throttle.{self.scope}.{'allowed' if allowed else 'throttled'}")
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+
+class PollRateThrottle(TokenBucketThrottle):
+    scope = "poll"
+
+
+class MessageRateThrottle(TokenBucketThrottle):
+    scope = "message"
+
+
+class ExportRateThrottle(TokenBucketThrottle):
+    scope = "export"
+
+
+class TypingRateThrottle(TokenBucketThrottle):
+    scope = "typing"
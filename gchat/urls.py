@@ -18,10 +18,8 @@ from django.urls import path, include, re_path
 from django.views.generic import TemplateView
 
 urlpatterns = [
-    # core
-    path("api/auth/", include("core.urls")),
-    # chat
-    path("api/chat/", include("chat.urls")),
+    # api, shared with the api only workers
+    path("", include("gchat.urls_api")),
     # admin
     path("admin/", admin.site.urls),
     # frontend
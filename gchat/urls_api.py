@@ -0,0 +1,14 @@
+"""gchat URL Configuration for the api only workers (gchat.settings_api)"""
+
+from django.urls import path, include
+
+from gchat.views import MetricsView
+
+urlpatterns = [
+    # core
+    path("api/auth/", include("core.urls")),
+    # chat
+    path("api/chat/", include("chat.urls")),
+    # metrics
+    path("api/metrics/", MetricsView.as_view()),
+]
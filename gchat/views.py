@@ -0,0 +1,14 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from gchat import metrics
+
+
+class MetricsView(APIView):
+    # kept out of gchat.metrics, the middleware imports it at boot
+    # the counters are the totals of every worker of the host
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(metrics.snapshot())
@@ -6,6 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    # the tests need the extra shards of the test settings
+    if sys.argv[1:2] == ["test"]:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gchat.settings_test")
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gchat.settings")
     try:
         from django.core.management import execute_from_command_line